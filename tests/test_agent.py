@@ -0,0 +1,19 @@
+import ast
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _default_quicksort_code():
+    # Parsed rather than imported so the test does not need openai installed.
+    tree = ast.parse((ROOT / "agent_quicksort.py").read_text())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(t, ast.Name) and t.id == "DEFAULT_QUICKSORT_CODE" for t in node.targets
+        ):
+            return ast.literal_eval(node.value)
+    raise AssertionError("DEFAULT_QUICKSORT_CODE not found in agent_quicksort.py")
+
+
+def test_default_code_matches_workdir_quicksort():
+    assert _default_quicksort_code() == (ROOT / "workdir" / "quicksort.py").read_text()
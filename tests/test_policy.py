@@ -0,0 +1,39 @@
+import pytest
+
+from sandbox import PolicyError, SandboxPolicy
+
+
+def test_default_policy():
+    p = SandboxPolicy()
+    p.check("python x.py")
+    with pytest.raises(PolicyError):
+        p.check("ls")
+    with pytest.raises(PolicyError):
+        p.check("bash -c 'rm -rf /'")
+    with pytest.raises(PolicyError):
+        p.check("   ")
+
+
+def test_backreferences_keep_their_own_groups():
+    p = SandboxPolicy(deny_patterns=["(x)", r"(\w)\1{3}"])
+    with pytest.raises(PolicyError, match=r"\\1"):
+        p.check("echo aaaa")
+
+
+def test_inline_global_flags_are_accepted():
+    p = SandboxPolicy(deny_patterns=["(x)", r"(?i)rm\s+-rf\s+/"])
+    with pytest.raises(PolicyError):
+        p.check("bash -c 'RM -RF /'")
+
+
+def test_list_changes_take_effect():
+    p = SandboxPolicy()
+    p.check("bash -c true")
+    p.allow.remove("bash")
+    with pytest.raises(PolicyError):
+        p.check("bash -c true")
+
+    p.check("echo curl")
+    p.deny_patterns.append("curl")
+    with pytest.raises(PolicyError):
+        p.check("echo curl")
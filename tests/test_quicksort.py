@@ -1,3 +1,7 @@
 from quicksort import quicksort
 def test_basic(): assert quicksort([3,1,2]) == [1,2,3]
 
+
+def test_large_keeps_original_objects():
+    out = quicksort([True, 0] * 600)
+    assert out == [0] * 600 + [1] * 600 and out[-1] is True
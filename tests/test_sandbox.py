@@ -0,0 +1,139 @@
+import gc
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import sandbox
+from sandbox import DockerSandbox, SandboxPolicy
+
+
+class FakeAPI:
+    """Just enough of docker.APIClient for the warm-container lifecycle."""
+
+    def __init__(self):
+        self.created = []
+        self.removed = []
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def create_container(self, **kwargs):
+        self.created.append(kwargs)
+        return {"Id": f"c{len(self.created)}"}
+
+    def start(self, cid):
+        pass
+
+    def remove_container(self, cid, force=False):
+        self.removed.append(cid)
+
+    # exec: every command exits with `exit_code` after `delay` seconds
+    exit_code = 0
+    delay = 0.0
+
+    def exec_create(self, cid, cmd, **kwargs):
+        self.last_cmd = cmd
+        return {"Id": "e1"}
+
+    def exec_start(self, exec_id, demux=False):
+        time.sleep(self.delay)
+        return b"out", None
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": self.exit_code}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeAPI()
+    client = SimpleNamespace(api=api, images=SimpleNamespace(get=lambda image: SimpleNamespace(id="sha256:x")))
+    monkeypatch.setattr(sandbox, "_client", lambda: client)
+    return api
+
+
+def _sandbox(tmp_path):
+    return DockerSandbox("img", str(tmp_path / "ws"), SandboxPolicy(), log_dir=str(tmp_path / "logs"))
+
+
+@pytest.mark.parametrize(
+    "cmd, argv",
+    [
+        ("python x.py", ["python", "x.py"]),
+        ("python3 -m pytest -q", ["python3", "-m", "pytest", "-q"]),
+        ("python -c 'print(1)'", ["python", "-c", "print(1)"]),
+        ("python x.py | cat", None),
+        ("python $HOME/x.py", None),
+        ("python x.py > out", None),
+        ('python -c "print(1)"', None),
+        ("python 'x.py", None),
+        ("ls -la", None),
+    ],
+)
+def test_argv_execs_plain_python_directly_and_everything_else_via_bash(cmd, argv):
+    assert DockerSandbox._argv(cmd) == (argv or ["bash", "-lc", cmd])
+
+
+def test_container_is_labelled_and_removed_when_sandbox_is_collected(api, tmp_path):
+    sb = _sandbox(tmp_path)
+    sb.close()   # stops the audit writer, which holds a reference to sb
+    sb.start()
+    assert api.created[0]["labels"][DockerSandbox.CONTAINER_LABEL] == "true"
+
+    del sb
+    gc.collect()
+    assert api.removed == ["c1"]
+
+
+def test_early_exit_124_is_not_a_timeout(api, tmp_path):
+    sb = _sandbox(tmp_path)
+    api.exit_code = 124
+    res = sb.run("python x.py", timeout=10)
+    sb.close()
+    assert res["code"] == 124 and "error" not in res
+    assert api.removed == ["c1"]   # only by close(), not torn down after the run
+
+
+def test_exit_124_at_deadline_is_a_timeout(api, tmp_path):
+    sb = _sandbox(tmp_path)
+    api.exit_code, api.delay = 124, 0.1
+    res = sb.run("python x.py", timeout=0.05)
+    assert res["ok"] is False and res["error"].startswith("timed out")
+    assert api.removed == ["c1"]
+    sb.close()
+
+
+def _audit_lines(sb):
+    with open(sb.audit_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_audit_events_from_many_threads_all_land_in_order(api, tmp_path):
+    sb = _sandbox(tmp_path)
+
+    def produce(tid):
+        for i in range(3000):
+            sb._audit({"tid": tid, "i": i})
+
+    threads = [threading.Thread(target=produce, args=(t,)) for t in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sb.close()
+
+    assert not sb._audit_thread.is_alive()   # stopped by the sentinel
+    events = _audit_lines(sb)
+    assert len(events) == 12000
+    for tid in range(4):
+        assert [e["i"] for e in events if e["tid"] == tid] == list(range(3000))
+
+
+def test_audit_after_close_is_written_synchronously(api, tmp_path):
+    sb = _sandbox(tmp_path)
+    sb._audit({"n": 1})
+    sb.close()
+    sb._audit({"n": 2})
+    assert [e["n"] for e in _audit_lines(sb)] == [1, 2]
@@ -0,0 +1,143 @@
+import os
+import stat
+from types import SimpleNamespace
+
+from sandbox import Transaction
+
+
+def _sandbox(tmp_path):
+    ws = tmp_path / "ws"
+    ws.mkdir()
+    return SimpleNamespace(workspace=str(ws))
+
+
+def test_rollback_catches_replacement_with_same_size_and_mtime(tmp_path):
+    sb = _sandbox(tmp_path)
+    a = os.path.join(sb.workspace, "a")
+    with open(a, "w") as f:
+        f.write("good-a")
+    st = os.stat(a)
+
+    with Transaction(sb):
+        with open(a + ".tmp", "w") as f:
+            f.write("EVIL-a")
+        os.utime(a + ".tmp", ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(a + ".tmp", a)
+        raise RuntimeError("boom")
+
+    assert open(a).read() == "good-a"
+
+
+def test_rollback_restores_in_place_rewrite(tmp_path):
+    sb = _sandbox(tmp_path)
+    a = os.path.join(sb.workspace, "a.txt")
+    with open(a, "w") as f:
+        f.write("original")
+
+    with Transaction(sb):
+        with open(a, "w") as f:
+            f.write("BROKEN")
+        raise RuntimeError("boom")
+
+    assert open(a).read() == "original"
+
+
+def test_rollback_restores_modified_deleted_and_drops_created(tmp_path):
+    sb = _sandbox(tmp_path)
+    ws = sb.workspace
+    os.makedirs(os.path.join(ws, "sub"))
+    for rel, text in [("a", "A"), ("sub/b", "B"), ("c", "C")]:
+        with open(os.path.join(ws, rel), "w") as f:
+            f.write(text)
+
+    with Transaction(sb):
+        with open(os.path.join(ws, "a"), "w") as f:
+            f.write("changed")
+        os.remove(os.path.join(ws, "sub/b"))
+        with open(os.path.join(ws, "new"), "w") as f:
+            f.write("N")
+        os.makedirs(os.path.join(ws, "newdir/x"))
+        raise RuntimeError("boom")
+
+    assert sorted(os.listdir(ws)) == ["a", "c", "sub"]
+    assert open(os.path.join(ws, "a")).read() == "A"
+    assert open(os.path.join(ws, "sub/b")).read() == "B"
+    assert open(os.path.join(ws, "c")).read() == "C"
+
+
+def test_empty_workspace_rollback_clears_it(tmp_path):
+    sb = _sandbox(tmp_path)
+    with Transaction(sb) as tx:
+        assert tx.snap is None
+        with open(os.path.join(sb.workspace, "new"), "w") as f:
+            f.write("N")
+        raise RuntimeError("boom")
+
+    assert os.listdir(sb.workspace) == []
+
+
+def test_paths_mode_restores_and_removes(tmp_path):
+    sb = _sandbox(tmp_path)
+    q = os.path.join(sb.workspace, "quicksort.py")
+    with open(q, "w") as f:
+        f.write("old")
+
+    with Transaction(sb, paths=["quicksort.py", "fresh.py"]) as tx:
+        assert tx.snap is None
+        with open(q, "w") as f:
+            f.write("new")
+        with open(os.path.join(sb.workspace, "fresh.py"), "w") as f:
+            f.write("x")
+        raise RuntimeError("boom")
+
+    assert os.listdir(sb.workspace) == ["quicksort.py"]
+    assert open(q).read() == "old"
+
+
+def test_success_keeps_changes_and_removes_snapshot(tmp_path):
+    sb = _sandbox(tmp_path)
+    a = os.path.join(sb.workspace, "a")
+    with open(a, "w") as f:
+        f.write("A")
+
+    with Transaction(sb) as tx:
+        assert os.path.isdir(tx.snap)
+        with open(a, "w") as f:
+            f.write("kept")
+
+    assert open(a).read() == "kept"
+    assert os.listdir(tmp_path) == ["ws"]
+
+
+def test_rollback_restores_same_size_in_place_write_with_old_mtime(tmp_path):
+    sb = _sandbox(tmp_path)
+    a = os.path.join(sb.workspace, "a")
+    with open(a, "w") as f:
+        f.write("good")
+    st = os.stat(a)
+
+    with Transaction(sb):
+        with open(a, "w") as f:
+            f.write("EVIL")
+        os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns))
+        raise RuntimeError("boom")
+
+    assert open(a).read() == "good"
+
+
+def test_rollback_restores_permissions(tmp_path):
+    sb = _sandbox(tmp_path)
+    os.makedirs(os.path.join(sb.workspace, "sub"))
+    a = os.path.join(sb.workspace, "sub", "a")
+    with open(a, "w") as f:
+        f.write("A")
+    os.chmod(a, 0o644)
+    os.chmod(os.path.dirname(a), 0o755)
+
+    with Transaction(sb):
+        os.chmod(a, 0o777)
+        os.chmod(os.path.dirname(a), 0o700)
+        raise RuntimeError("boom")
+
+    assert stat.S_IMODE(os.stat(a).st_mode) == 0o644
+    assert stat.S_IMODE(os.stat(os.path.dirname(a)).st_mode) == 0o755
@@ -1,8 +1,10 @@
 def quicksort(lst: list[int]) -> list[int]:
     """
-    Return a new list containing the elements of lst sorted using the quicksort algorithm.
+    Return a new list containing the elements of lst in ascending order.
 
-    This implementation is pure Python and does not modify the input list.
+    Delegates to the built-in sorted() (Timsort, implemented in C), which is
+    far faster than a recursive pure-Python quicksort; the input list is not
+    modified.
 
     Doctests:
     >>> quicksort([3, 1, 2])
@@ -12,13 +14,7 @@ def quicksort(lst: list[int]) -> list[int]:
     >>> quicksort([5, -1, 3, 5, 2])
     [-1, 2, 3, 5, 5]
     """
-    if len(lst) <= 1:
-        return lst[:]
-    pivot = lst[len(lst) // 2]
-    left = [x for x in lst if x < pivot]
-    middle = [x for x in lst if x == pivot]
-    right = [x for x in lst if x > pivot]
-    return quicksort(left) + middle + quicksort(right)
+    return sorted(lst)
 
 
 if __name__ == "__main__":